@@ -10,13 +10,25 @@ BC-211 Battery Monitor + ntfy.sh notification (CP2112 driver version)
 2025,Nov 7M4MON
 """
 
-from flask import Flask, jsonify, render_template
-from cp2112_driver import Cp2112I2CBus, Cp2112Error
+from flask import Flask, Response, jsonify, render_template, request
+from waitress import serve
+from cp2112_driver import Cp2112Error
+try:
+    # Cython 版（cp2112_fast.pyx をビルド済みの場合）: USB 待ちの間 GIL を解放
+    from cp2112_fast import FastBus as Cp2112I2CBus
+except ImportError:
+    from cp2112_driver import Cp2112I2CBus
 
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
+import struct
+import threading
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 
@@ -47,9 +59,41 @@ STATIC_DIR = os.path.join(RUNTIME_DIR, "static")
 ntfy_url: str = ""
 HOST: str = "0.0.0.0"
 PORT: int = 5000
-last_states = None   # {slot_no: "SLOT EMPTY" / "CHARGING" / "FULL" / "ERR"}
+last_states: int = -1   # pack_states() の前回値（-1 = 未取得）
 bus: Cp2112I2CBus | None = None
 
+# --- background sampler ---
+SAMPLE_INTERVAL = 0.1   # [s] I2C 読み取り周期
+STALE_AFTER = 2.0       # [s] これより古いサンプルは 503 扱い
+_bus_lock = threading.Lock()  # bus へのアクセスを直列化（/api/status は取らない）
+# サンプラーが 1 回の代入で差し替える最新状態（/api/status はロックなしで読む）
+#   (sample_ts, sample_mono, payload, etag, attempt_ts, error)
+#   sample_ts/payload/etag: 最後に成功したサンプル（payload は未取得なら None）
+#   sample_mono: そのサンプルの time.monotonic()（/api/status の鮮度判定用）
+#   attempt_ts: 最後にサンプリングを試みた時刻
+_status: tuple[float, float, bytes | None, str, float, str] = (
+    0.0, 0.0, None, "", 0.0, "CP2112 not initialized",
+)
+
+# --- bus recovery ---
+INIT_COOLDOWN = 2.0     # [s] この間隔以内の init_bus() 再実行はスキップ
+_last_init: float | None = None   # 最後に init_bus() を実行した time.monotonic()
+_error_streak = 0       # 連続エラー回数（recover_bus() の段階）
+
+# --- ntfy ---
+NTFY_DEDUP_SEC = 30.0   # [s] 同じスロットの再通知を抑制する時間
+# ワーカー 1 本: Session を単一スレッドで使い、通知の順序も保つ
+_ntfy_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ntfy")
+_ntfy_session = requests.Session()   # TCP/TLS を通知間で再利用
+_ntfy_adapter = HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=1,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+)
+_ntfy_session.mount("https://", _ntfy_adapter)
+_ntfy_session.mount("http://", _ntfy_adapter)
+_ntfy_last_sent: dict[int, float] = {}   # {slot_no: 最終送信時刻 (time.monotonic())}
+
 # Flask app (templates/static 明示版: PyInstaller exe でも index.html を読めるようにする)
 app = Flask(__name__, template_folder=TEMPLATE_DIR, static_folder=STATIC_DIR)
 
@@ -57,12 +101,8 @@ app = Flask(__name__, template_folder=TEMPLATE_DIR, static_folder=STATIC_DIR)
 # -------------------------------------------------------------
 #   MCP23017 helpers (over I2C via CP2112)
 # -------------------------------------------------------------
-def mcp_write8(dev: Cp2112I2CBus, reg: int, val: int) -> None:
-    dev.write_reg8(I2C_ADDR, reg, val & 0xFF)
-
-
-def mcp_read8(dev: Cp2112I2CBus, reg: int) -> int:
-    return dev.read_reg8(I2C_ADDR, reg) & 0xFF
+def mcp_writeN(dev: Cp2112I2CBus, reg: int, data: bytes) -> None:
+    dev.write_regN(I2C_ADDR, reg, data)
 
 
 def mcp_setup_for_diode_noninvert_3v3(dev: Cp2112I2CBus) -> None:
@@ -70,87 +110,81 @@ def mcp_setup_for_diode_noninvert_3v3(dev: Cp2112I2CBus) -> None:
     ダイオード非反転 + MCP23017内蔵プルアップ使用を前提とした設定。
     MCP23017 / CP2112 とも VIO=3.3V 動作を想定。
     A0..A5, B0..B5 を入力にし、内蔵プルアップを有効にする。
+    BANK=0 / SEQOP=0（電源投入時デフォルト）の自動インクリメントを使い、
+    連続レジスタをまとめて書き込む。
     """
-    # A0..A5 input
-    mcp_write8(dev, IODIRA, 0x3F)
-    # B0..B5 input
-    mcp_write8(dev, IODIRB, 0x3F)
+    # IODIRA, IODIRB : A0..A5, B0..B5 input
+    # IPOLA,  IPOLB  : 論理反転なし（Active-Low LED をそのまま 1=OFF, 0=ON で読む）
+    mcp_writeN(dev, IODIRA, bytes([0x3F, 0x3F, 0x00, 0x00]))
 
-    # 論理反転なし（Active-Low LED をそのまま 1=OFF, 0=ON で読む）
-    mcp_write8(dev, IPOLA,  0x00)
-    mcp_write8(dev, IPOLB,  0x00)
+    # GPPUA, GPPUB : 内蔵プルアップ ON（A0..A5, B0..B5）
+    mcp_writeN(dev, GPPUA, bytes([0x3F, 0x3F]))
 
-    # 内蔵プルアップ ON（A0..A5, B0..B5）
-    mcp_write8(dev, GPPUA,  0x3F)
-    mcp_write8(dev, GPPUB,  0x3F)
+
+def read_ports(dev: Cp2112I2CBus) -> bytes:
+    """
+    GPIOA, GPIOB を 2 バイト (A0..A5, B0..B5) のまま返す（12bit への
+    マージは merge_12bits() で行う）。
+    GPIOA/GPIOB は隣接レジスタなので、自動インクリメント (IOCON.SEQOP=0)
+    で 1 回の I2C トランザクションにまとめて読む。
+    """
+    return dev.read_regN(I2C_ADDR, GPIOA, 2)
 
 
-def read_12bits(dev: Cp2112I2CBus) -> int:
+_U16 = struct.Struct("<H")   # GPIOA=下位, GPIOB=上位
+
+
+def merge_12bits(ports: bytes) -> int:
     """
     A0..A5 → bit0..5
     B0..B5 → bit6..11
-    の 12bit としてまとめて返す。
+    の 12bit としてまとめる（API の bits12 用）。
     """
-    a = mcp_read8(dev, GPIOA) & 0x3F  # A0..A5
-    b = mcp_read8(dev, GPIOB) & 0x3F  # B0..B5
-    return (b << 6) | a
+    bits = _U16.unpack_from(ports)[0] & 0x3F3F
+    return ((bits >> 2) & 0x0FC0) | (bits & 0x003F)
 
 
 # -------------------------------------------------------------
 #   State decoding (Active-Low LED)
 # -------------------------------------------------------------
-def slot_state(r: int, g: int) -> str:
-    """
-    r,g: 1 = LED OFF, 0 = LED ON （オープンコレクタ Active Low）
+# (ポート, 下位ビット位置) for S1..S6 — 各スロットは R=下位, G=上位 の隣接 2bit
+_SLOT_PAIRS = ((1, 0), (1, 2), (1, 4), (0, 0), (0, 2), (0, 4))   # 0=A, 1=B
 
-    NJW4100 の状態想定：
-        R:OFF,G:OFF → スロット空 or 初期状態
-        R:ON, G:OFF → 充電中
-        R:OFF,G:ON  → 充電完了
-    """
-    if r == 1 and g == 1:
-        return "SLOT EMPTY"
-    if r == 0 and g == 1:
-        return "CHARGING"
-    if r == 1 and g == 0:
-        return "FULL"
-    return "ERR"  # 同時点灯など想定外
+# 隣接 2bit (G << 1) | R → 状態
+#   R,G: 1 = LED OFF, 0 = LED ON （オープンコレクタ Active Low）
+#
+#   NJW4100 の状態想定：
+#       R:OFF,G:OFF (11) → スロット空 or 初期状態
+#       R:ON, G:OFF (10) → 充電中
+#       R:OFF,G:ON  (01) → 充電完了
+#       R:ON, G:ON  (00) → ERR（同時点灯など想定外）
+_PAIR_STATE_LUT = ("ERR", "FULL", "CHARGING", "SLOT EMPTY")
 
 
-def decode(bits12: int) -> list[dict]:
+def decode(a: int, b: int) -> list[dict]:
     """
     現物の配線にもとづくビット割り当て：
 
-        bit0..5 : A0..A5 → S4..S6
-        bit6..11: B0..B5 → S1..S3
+        A0..A5 → S4..S6
+        B0..B5 → S1..S3
 
-    mapping:
-        ("S1_R", 6), ("S1_G", 7),
-        ("S2_R", 8), ("S2_G", 9),
-        ("S3_R",10), ("S3_G",11),
-        ("S4_R", 0), ("S4_G", 1),
-        ("S5_R", 2), ("S5_G", 3),
-        ("S6_R", 4), ("S6_G", 5),
+    mapping (_SLOT_PAIRS):
+        S1: R=B0, G=B1
+        S2: R=B2, G=B3
+        S3: R=B4, G=B5
+        S4: R=A0, G=A1
+        S5: R=A2, G=A3
+        S6: R=A4, G=A5
     """
-    mapping = [
-        ("S1_R", 6), ("S1_G", 7),
-        ("S2_R", 8), ("S2_G", 9),
-        ("S3_R",10), ("S3_G",11),
-        ("S4_R", 0), ("S4_G", 1),
-        ("S5_R", 2), ("S5_G", 3),
-        ("S6_R", 4), ("S6_G", 5),
-    ]
-    vals: dict[str, int] = {name: (bits12 >> bit) & 1 for (name, bit) in mapping}
-
+    ports = (a, b)
     slots: list[dict] = []
-    for i in range(1, 7):
-        r = vals[f"S{i}_R"]
-        g = vals[f"S{i}_G"]
+    for i, (port, lo_bit) in enumerate(_SLOT_PAIRS):
+        rg = (ports[port] >> lo_bit) & 3
         slots.append({
-            "slot": i,
-            "state": slot_state(r, g),
-            "R": r,
-            "G": g,
+            "slot": i + 1,
+            "state": _PAIR_STATE_LUT[rg],
+            "R": rg & 1,
+            "G": rg >> 1,
         })
     return slots
 
@@ -200,44 +234,77 @@ def load_config() -> None:
         ntfy_url = ""
 
 
-def send_ntfy(slot_full: int, slots: list[dict]) -> None:
+def _send_ntfy_sync(slot_full: int, states_str: str) -> None:
+    """ntfy.sh への POST 本体（_ntfy_executor のワーカーで実行）。"""
+    title = f"BC-211 Slot {slot_full} FULL"
+    body = f"{title}\nCurrent states: {states_str}"
+
+    try:
+        _ntfy_session.post(ntfy_url, data=body.encode("utf-8"), timeout=5)
+        print(f"[ntfy] sent for slot {slot_full}")
+    except Exception as e:
+        print("[ntfy] error:", e)
+
+
+def send_ntfy(slot_full: int, slots: list[dict], mono: float) -> None:
     """
     指定スロットが FULL になったとき、ntfy.sh に通知を送る。
     ntfy_url が空なら何もしない。
+    送信はバックグラウンドで行い、呼び出し元はブロックしない。
+    同じスロットへの通知は NTFY_DEDUP_SEC 以内なら送らない。
+    mono: サンプル時の time.monotonic()（時計の巻き戻しの影響を受けない）
     """
-    global ntfy_url
     if not ntfy_url:
         return
 
+    last = _ntfy_last_sent.get(slot_full)
+    if last is not None and mono - last < NTFY_DEDUP_SEC:
+        print(f"[ntfy] skipped for slot {slot_full} (sent {mono - last:.0f}s ago)")
+        return
+    _ntfy_last_sent[slot_full] = mono
+
     states_str = ", ".join(f"S{s['slot']}={s['state']}" for s in slots)
-    title = f"BC-211 Slot {slot_full} FULL"
-    body = f"{title}\nCurrent states: {states_str}"
+    _ntfy_executor.submit(_send_ntfy_sync, slot_full, states_str)
 
-    try:
-        requests.post(ntfy_url, data=body.encode("utf-8"), timeout=5)
-        print(f"[ntfy] sent for slot {slot_full}")
-    except Exception as e:
-        print("[ntfy] error:", e)
+
+_LO_BITS_MASK = 0x555   # 各スロットの下位 bit (bit0, 2, ..., 10)
 
 
-def check_full_transition(slots: list[dict]) -> None:
+def pack_states(ports: bytes) -> int:
+    """
+    6 スロットの状態を 2bit ずつ 12bit の int にまとめる（S1 = bit0..1）。
+        SLOT EMPTY=0, CHARGING=1, FULL=2, ERR=3
+
+    隣接 2bit (G << 1) | R を反転するとちょうどこのコードになるので、
+    B (S1..S3) と A (S4..S6) を並べて反転するだけで求まる。
+    """
+    a, b = ports
+    return ~(((a & 0x3F) << 6) | (b & 0x3F)) & 0xFFF
+
+
+def _full_mask(packed: int) -> int:
+    """コード == FULL (0b10) のスロットの下位 bit を立てたマスク。"""
+    return (packed >> 1) & ~packed & _LO_BITS_MASK
+
+
+def check_full_transition(curr: int, slots: list[dict], mono: float) -> None:
     """
     前回状態からの変化を見て、
     「FULL に遷移した瞬間」のスロットがあれば ntfy 送信。
+    curr: pack_states() の値
+    mono: サンプル時の time.monotonic()（時計を読み直さずに使う）
     """
     global last_states
-    if last_states is None:
-        last_states = {s["slot"]: s["state"] for s in slots}
+    prev = last_states
+    last_states = curr
+    if prev < 0 or prev == curr:
         return
 
-    for s in slots:
-        slot_no = s["slot"]
-        prev = last_states.get(slot_no)
-        now = s["state"]
-        if prev != "FULL" and now == "FULL":
-            send_ntfy(slot_no, slots)
-
-    last_states = {s["slot"]: s["state"] for s in slots}
+    newly_full = _full_mask(curr) & ~_full_mask(prev)
+    while newly_full:
+        low = newly_full & -newly_full
+        send_ntfy(low.bit_length() // 2 + 1, slots, mono)
+        newly_full ^= low
 
 
 # -------------------------------------------------------------
@@ -247,8 +314,15 @@ def init_bus() -> None:
     """
     CP2112 + MCP23017 を初期化。
     既存の bus があれば閉じてから新規オープン。
+    直前 INIT_COOLDOWN 秒以内に実行済みなら、USB を叩き続けないよう何もしない
+    （サンプラーが SAMPLE_INTERVAL ごとに呼ぶので、スキップ時はログも出さない）。
     """
-    global bus
+    global bus, _last_init
+    now = time.monotonic()
+    if _last_init is not None and now - _last_init < INIT_COOLDOWN:
+        return
+    _last_init = now
+
     # 既存をクローズ
     if bus is not None:
         try:
@@ -267,6 +341,29 @@ def init_bus() -> None:
         bus = None
 
 
+def recover_bus() -> None:
+    """
+    I2C エラー時の段階的リカバリ。連続エラー回数に応じて重くしていく：
+        1回目: SMBus 設定の再送のみ（HID は開いたまま）
+        2回目: init_bus() によるフル再オープン
+    CP2112 の Reset Device は USB 再列挙を伴い HID ハンドルが無効になるため、
+    リセットは init_bus() の close/open で代用する。
+    """
+    global _error_streak
+    _error_streak += 1
+
+    if bus is not None and _error_streak < 2:
+        try:
+            bus.recover()
+            print("[driver] recovered (SMBus config re-sent)")
+            return
+        except Exception as e:
+            print("[driver] SMBus config re-send failed:", e)
+
+    _error_streak = 0
+    init_bus()
+
+
 # -------------------------------------------------------------
 #   Flask routes
 # -------------------------------------------------------------
@@ -275,63 +372,120 @@ def index():
     return render_template("index.html")
 
 
-@app.route("/api/status")
-def api_status():
-    global bus
+def _sample_failed(error: str) -> None:
+    """読み取り失敗を _status に反映する（最後の成功サンプルは残し、鮮度は /api/status で判定）。"""
+    global _status
+    sample_ts, sample_mono, payload, etag, _, _ = _status
+    _status = (sample_ts, sample_mono, payload, etag, time.time(), error)
+
+
+def _read_ports_with_recovery() -> tuple[bytes | None, str]:
+    """
+    bus から 2 バイト読む（_bus_lock 保持中に呼ぶ）。
+    最大2回トライ：1回目失敗 → recover_bus() → 2回目再チャレンジ。
+    戻り値: (ports or None, エラーメッセージ)
+    """
+    global _error_streak
 
     if bus is None:
-        # 一応ここでも初期化を試みる
         init_bus()
         if bus is None:
-            return jsonify({
-                "timestamp": time.time(),
-                "bits12": None,
-                "slots": [],
-                "ntfy_url": ntfy_url,
-                "error": "CP2112 not initialized",
-            }), 503
-
-    bits = None
-    last_error: Exception | None = None
+            return None, "CP2112 not initialized"
 
-    # 最大2回トライ：1回目失敗 → 再初期化 → 2回目再チャレンジ
+    last_error: Exception | None = None
     for attempt in range(2):
         try:
-            bits = read_12bits(bus)  # type: ignore[arg-type]
-            last_error = None
-            break
+            ports = read_ports(bus)  # type: ignore[arg-type]
+            _error_streak = 0
+            return ports, ""
         except (Cp2112Error, OSError, IOError, ValueError) as e:
             last_error = e
             print(f"[I2C] read error (attempt {attempt+1}):", e)
-            init_bus()
+            recover_bus()
             if bus is None:
                 break
         except Exception as e:
             last_error = e
             print(f"[I2C] unexpected error (attempt {attempt+1}):", e)
-            init_bus()
+            recover_bus()
             if bus is None:
                 break
+    return None, f"CP2112 not connected or I2C error: {last_error}"
 
-    if bits is None:
-        # 2回とも失敗したら、エラーJSONを返す（サーバは落とさない）
-        return jsonify({
-            "timestamp": time.time(),
-            "bits12": None,
-            "slots": [],
-            "ntfy_url": ntfy_url,
-            "error": f"CP2112 not connected or I2C error: {last_error}",
-        }), 503
 
-    slots = decode(bits)
-    check_full_transition(slots)
+def sample_once() -> None:
+    """
+    12bit を 1 回読み取り、_status を更新する（バックグラウンドスレッドから呼ぶ）。
+    _bus_lock は I2C の間だけ保持し、結果は _status の差し替え 1 回で公開する。
+    時刻 (time.time() と time.monotonic()) はここで 1 回ずつ読み、API と ntfy 判定はその値を使う。
+    """
+    global _status
+
+    with _bus_lock:
+        ports, error = _read_ports_with_recovery()
+
+    if ports is None:
+        _sample_failed(error)
+        return
 
-    return jsonify({
-        "timestamp": time.time(),
+    now = time.time()
+    mono = time.monotonic()
+    slots = decode(*ports)
+    bits = merge_12bits(ports)
+    # サンプルごとに 1 回だけ JSON 化しておき、/api/status はそのまま返す
+    payload = orjson.dumps({
+        "timestamp": now,
         "bits12": bits,
         "slots": slots,
         "ntfy_url": ntfy_url,
     })
+    # payload は timestamp 以外 bits12 (+ 固定の ntfy_url) で決まるので (弱い) ETag は bits12 から作る
+    _status = (now, mono, payload, f"{bits:03x}", now, "")
+
+    # ntfy 判定はクライアントのポーリング有無に関係なくここで行う
+    check_full_transition(pack_states(ports), slots, mono)
+
+
+def sampler_loop() -> None:
+    """SAMPLE_INTERVAL ごとに sample_once() を呼び続ける。"""
+    while True:
+        try:
+            sample_once()
+        except Exception as e:
+            # スレッドは落とさない
+            print("[sampler] unexpected error:", e)
+        time.sleep(SAMPLE_INTERVAL)
+
+
+@app.route("/api/status")
+def api_status():
+    # I2C にもロックにも触れず、サンプラーが公開した最新値を返すだけ
+    sample_ts, sample_mono, payload, etag, attempt_ts, error = _status
+
+    # サンプラーが失敗し続けている / 止まっている場合も STALE_AFTER を超えたら 503
+    if payload is None or time.monotonic() - sample_mono > STALE_AFTER:
+        if not error:
+            error = f"no sample for more than {STALE_AFTER:.0f}s (sampler stalled)"
+        return jsonify({
+            "timestamp": attempt_ts,
+            "bits12": None,
+            "slots": [],
+            "ntfy_url": ntfy_url,
+            "error": error,
+        }), 503
+
+    # 状態が変わっていなければ 304（ボディなし）。弱い/複数指定の If-None-Match も考慮
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(payload, mimetype="application/json")
+    # 本文の timestamp はサンプルごとに変わるので、bits12 由来の ETag は弱い検証子
+    resp.set_etag(etag, weak=True)
+    # 304 でもヘッダは更新されるので、サンプル時刻はヘッダでも返す（ダッシュボードの Last updated 用）
+    resp.headers["X-Sample-Time"] = f"{sample_ts:.3f}"
+    # ブラウザに毎回 If-None-Match 付きで再検証させる
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 # -------------------------------------------------------------
@@ -339,7 +493,10 @@ def api_status():
 # -------------------------------------------------------------
 if __name__ == "__main__":
     load_config()
-    init_bus()
-    print(f"[flask] starting dev server on {HOST}:{PORT} (LAN use only)")
-    print("[flask] インターネットへ公開せず、家庭内/社内LANの範囲でご利用ください。")
-    app.run(host=HOST, port=PORT)
+    with _bus_lock:
+        init_bus()
+    threading.Thread(target=sampler_loop, name="sampler", daemon=True).start()
+    print(f"[waitress] starting server on {HOST}:{PORT} (LAN use only)")
+    print("[waitress] インターネットへ公開せず、家庭内/社内LANの範囲でご利用ください。")
+    # マルチスレッド WSGI サーバ（keep-alive 対応）。/api/status はキャッシュを返すだけ
+    serve(app, host=HOST, port=PORT, threads=8)
@@ -6,6 +6,7 @@ Minimal CP2112 I2C helper for BC-211 monitor.
 This file is written from scratch based on CP2112 datasheet / app note.
 """
 
+import os
 import time
 import hid
 
@@ -24,6 +25,8 @@ class Cp2112I2CBus:
     - Provides 8-bit I2C register R/W helpers:
         * write_reg8(i2c_addr, reg, value)
         * read_reg8(i2c_addr, reg) -> value
+        * write_regN(i2c_addr, reg, data) (register auto-increment)
+        * read_regN(i2c_addr, reg, n) -> bytes (register auto-increment)
     """
 
     def __init__(
@@ -33,29 +36,50 @@ class Cp2112I2CBus:
         serial: str | None = None,
         *,
         enable_rx_tx_led: bool = True,
+        smbus_clock_hz: int = 400_000,
+        verbose: bool = False,
     ) -> None:
-        self._dev = hid.device()
         # open CP2112 HID interface
-        if serial is None:
-            self._dev.open(vendor_id, product_id)
-        else:
-            self._dev.open(vendor_id, product_id, serial)
+        self._dev = self._open_device(vendor_id, product_id, serial)
 
-        # optional: print info (debug)
-        try:
-            print("CP2112 Manufacturer:", self._dev.get_manufacturer_string())
-            print("CP2112 Product     :", self._dev.get_product_string())
-            print("CP2112 Serial      :", self._dev.get_serial_number_string())
-        except Exception:
-            # some stacks may fail on these; ignore
-            pass
+        # preallocated output reports (command byte fixed, variable slots
+        # are overwritten per transfer to avoid building a list every call)
+        self._buf_read = bytearray([0x11, 0x00, 0x00, 0x00, 0x01, 0x00])  # Write-Read
+        self._buf_write = bytearray([0x14, 0x00, 0x02, 0x00, 0x00])       # Write (1 reg)
+        self._buf_force = bytearray([0x12, 0x00, 0x00])                   # Force Read
+        self._buf_status = bytes([0x15, 0x01])                            # Get Status
+
+        # optional: print info (debug). Each is a USB string descriptor
+        # request, so only when verbose=True or CP2112_DEBUG is set.
+        if verbose or os.environ.get("CP2112_DEBUG"):
+            try:
+                print("CP2112 Manufacturer:", self._dev.get_manufacturer_string())
+                print("CP2112 Product     :", self._dev.get_product_string())
+                print("CP2112 Serial      :", self._dev.get_serial_number_string())
+            except Exception:
+                # some stacks may fail on these; ignore
+                pass
 
         # configure GPIO and SMBus engine
+        self._smbus_clock_hz = smbus_clock_hz
         self._configure_gpio(led_mode=enable_rx_tx_led)
         self._configure_smbus()
 
     # -------------------- low-level helpers --------------------
 
+    def _open_device(self, vendor_id: int, product_id: int, serial: str | None):
+        """
+        Open the HID device and return the handle used as self._dev.
+        Subclasses (e.g. cp2112_fast.FastBus) may return a different
+        object with the same write / read / send_feature_report API.
+        """
+        dev = hid.device()
+        if serial is None:
+            dev.open(vendor_id, product_id)
+        else:
+            dev.open(vendor_id, product_id, serial)
+        return dev
+
     def _send_feature(self, payload: list[int]) -> None:
         """
         Send a HID feature report.
@@ -71,6 +95,17 @@ class Cp2112I2CBus:
         # give OS / USB stack a moment
         time.sleep(0.05)
 
+    def recover(self) -> None:
+        """
+        Lightweight recovery without closing / re-opening the HID device:
+        re-send the SMBus configuration only.
+
+        Reset Device (0x01) makes the CP2112 re-enumerate on USB, which
+        invalidates this handle, so anything heavier is a full close +
+        new Cp2112I2CBus().
+        """
+        self._configure_smbus()
+
     def close(self) -> None:
         """Close underlying HID device."""
         try:
@@ -110,45 +145,96 @@ class Cp2112I2CBus:
         Configure SMBus engine: clock, timeouts, retries etc.
 
         The exact layout of this feature report is from the CP2112 datasheet /
-        application note. Values below select roughly 100 kHz I2C and
-        reasonable timeouts for short transfers.
+        application note. The clock is self._smbus_clock_hz (400 kHz fast-mode
+        by default; MCP23017 supports it at 3.3V) and the timeouts are
+        reasonable for short transfers.
         """
+        clock = self._smbus_clock_hz
         # 0x06: Set SMBus Configuration
         # The following byte sequence is based on CP2112 documentation
         # (clock, timeouts, retry count, etc).
         config = [
             0x06,
-            0x00,  # reserved
-            0x01,  # enable SMBus
-            0x86, 0xA0,  # clock div / timeout (approx 100 kHz)
-            0x02, 0x00,  # slave address (unused in host mode)
-            0x00,        # reserved
-            0xFF, 0x00,  # read timeout
-            0xFF, 0x01,  # write timeout
-            0x00, 0x0F,  # retries, etc.
+            (clock >> 24) & 0xFF,   # clock speed [Hz], 32-bit big-endian
+            (clock >> 16) & 0xFF,
+            (clock >> 8) & 0xFF,
+            clock & 0xFF,
+            0x02,        # device address (unused in host mode)
+            0x00,        # auto send read: off
+            0x00, 0xFF,  # write timeout
+            0x00, 0xFF,  # read timeout
+            0x01,        # SCL low timeout: on
+            0x00, 0x0F,  # retry time
         ]
         self._send_feature(config)
 
     # -------------------- I2C helpers --------------------
 
-    def _wait_transfer_complete(self, *, attempts: int = 10, delay: float = 0.01) -> None:
+    def _wait_transfer_complete(
+        self,
+        *,
+        timeout: float = 0.1,
+        initial_delay: float = 0.0005,
+        max_delay: float = 0.005,
+    ) -> None:
         """
         Poll transfer status until the SMBus engine reports that data
         is ready or timeout occurs.
+
+        The 0x15 status request is only re-issued after a 0x16 response
+        has been consumed; while a response is still pending we just keep
+        reading (hidapi blocks in the kernel for up to 5 ms per read).
+        Between polls we back off exponentially from initial_delay up to
+        max_delay, bounded by a monotonic deadline.
         """
-        for _ in range(attempts):
-            # 0x15: Get Transfer Status
-            self._dev.write([0x15, 0x01])
-            resp = self._dev.read(7)
-            if not resp:
-                time.sleep(delay)
-                continue
-            # 0x16: Transfer Status Response
-            if resp[0] == 0x16 and resp[2] == 5:
-                return
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        need_request = True
+        while True:
+            if need_request:
+                # 0x15: Get Transfer Status
+                self._dev.write(self._buf_status)
+                need_request = False
+            resp = self._dev.read(7, timeout_ms=5)
+            if resp and resp[0] == 0x16:
+                # 0x16: Transfer Status Response
+                if resp[2] == 5:
+                    return
+                need_request = True
+            if time.monotonic() >= deadline:
+                break
             time.sleep(delay)
+            delay = min(delay * 2, max_delay)
         raise Cp2112Error("CP2112 SMBus transfer timeout")
 
+    def _read_response(self, n: int, *, timeout_ms: int = 20) -> bytes:
+        """
+        Collect n bytes of 0x13 Data Read Response after a Write-Read request.
+
+        A 0x13 report carrying data means the transfer has completed, so
+        no separate 0x15 status poll is needed. Only when the first force
+        read comes back empty do we poll the status once and retry.
+        """
+        data = bytearray()
+        recovered = False
+        while len(data) < n:
+            remain = n - len(data)
+            # 0x12: Force Read Response (length, big-endian)
+            buf = self._buf_force
+            buf[1] = (remain >> 8) & 0xFF
+            buf[2] = remain & 0xFF
+            self._dev.write(buf)
+            resp = self._dev.read(64, timeout_ms=timeout_ms)
+            # resp[0]=0x13, resp[1]=status, resp[2]=length, resp[3:]=data
+            if not resp or len(resp) < 3 or resp[0] != 0x13 or resp[2] == 0:
+                if recovered:
+                    raise Cp2112Error("CP2112 read: empty response")
+                self._wait_transfer_complete()
+                recovered = True
+                continue
+            data.extend(resp[3:3 + resp[2]])
+        return bytes(data[:n])
+
     def write_reg8(self, i2c_addr: int, reg: int, value: int) -> None:
         """
         Write 8-bit value to [i2c_addr]/reg.
@@ -158,36 +244,57 @@ class Cp2112I2CBus:
 
         # 0x14: Data Write Request
         # format: [0x14, addr<<1, count, data...]
-        pkt = [0x14, (i2c_addr << 1) & 0xFE, 0x02, reg & 0xFF, value & 0xFF]
+        pkt = self._buf_write
+        pkt[1] = (i2c_addr << 1) & 0xFE
+        pkt[3] = reg & 0xFF
+        pkt[4] = value & 0xFF
         written = self._dev.write(pkt)
         if written <= 0:
             raise Cp2112Error("CP2112 write_reg8 failed")
 
-        # poll completion
+        # poll completion (the CP2112 only reports 0x16 in answer to 0x15)
+        self._wait_transfer_complete()
+
+    def write_regN(self, i2c_addr: int, reg: int, data: bytes) -> None:
+        """
+        Write data to [i2c_addr]/reg, reg+1, ... in a single transfer
+        (relies on the slave's register auto-increment).
+        """
+        if not (1 <= len(data) <= 60):
+            raise ValueError("data length must be 1..60")
+
+        # 0x14: Data Write Request (up to 61 bytes incl. register address)
+        # format: [0x14, addr<<1, count, reg, data...]
+        pkt = bytes([0x14, (i2c_addr << 1) & 0xFE, len(data) + 1, reg & 0xFF, *data])
+        written = self._dev.write(pkt)
+        if written <= 0:
+            raise Cp2112Error("CP2112 write_regN failed")
+
+        # poll completion (the CP2112 only reports 0x16 in answer to 0x15)
         self._wait_transfer_complete()
 
     def read_reg8(self, i2c_addr: int, reg: int) -> int:
         """
         Read 8-bit value from [i2c_addr]/reg.
         """
+        return self.read_regN(i2c_addr, reg, 1)[0]
+
+    def read_regN(self, i2c_addr: int, reg: int, n: int) -> bytes:
+        """
+        Read n bytes starting at [i2c_addr]/reg in a single Write-Read
+        transfer (relies on the slave's register auto-increment).
+        """
+        if not (1 <= n <= 512):
+            raise ValueError("n must be 1..512")
+
         # 0x11: Data Write-Read Request
-        # [0x11, addr<<1, 0x00, read_len, write_len, reg]
-        self._dev.write([
-            0x11,
-            (i2c_addr << 1) & 0xFE,
-            0x00,      # no flags
-            0x01,      # read 1 byte
-            0x01,      # write 1 byte (the register address)
-            reg & 0xFF
-        ])
-
-        # wait until data is ready
-        self._wait_transfer_complete()
+        # [0x11, addr<<1, read_len(hi), read_len(lo), write_len, reg]
+        # write_len is fixed to 1 (the register address)
+        pkt = self._buf_read
+        pkt[1] = (i2c_addr << 1) & 0xFE
+        pkt[2] = (n >> 8) & 0xFF
+        pkt[3] = n & 0xFF
+        pkt[5] = reg & 0xFF
+        self._dev.write(pkt)
 
-        # 0x12: Force Read Response
-        self._dev.write([0x12, 0x00, 0x01])  # offset=0, length=1
-        resp = self._dev.read(4)
-        if not resp or len(resp) < 4:
-            raise Cp2112Error("CP2112 read_reg8: empty response")
-        # resp[0]=0x13, resp[3]=data
-        return resp[3]
+        return self._read_response(n)
@@ -0,0 +1,222 @@
+# cython: language_level=3
+"""
+cp2112_fast.pyx
+
+Optional Cython accelerator for cp2112_driver.Cp2112I2CBus.
+
+- _HidDev talks to libhidapi directly and releases the GIL around every
+  hid_write / hid_read_timeout, so the web server threads keep running
+  while a USB transfer is in flight.
+- FastBus keeps all configuration / recovery logic of Cp2112I2CBus and
+  only replaces the hot read path (0x11 request + 0x12/0x13 loop) with
+  a single C loop.
+
+Build with setup_fast.py (handles the per-platform hidapi library name
+and header location):
+    python setup_fast.py build_ext --inplace
+"""
+
+from libc.stddef cimport wchar_t
+from cpython.mem cimport PyMem_Free
+
+from cp2112_driver import Cp2112Error, Cp2112I2CBus
+
+
+cdef extern from "Python.h":
+    wchar_t* PyUnicode_AsWideCharString(object unicode, Py_ssize_t* size) except NULL
+    object PyUnicode_FromWideChar(const wchar_t* w, Py_ssize_t size)
+
+
+cdef extern from "hidapi.h" nogil:
+    ctypedef struct hid_device:
+        pass
+    int hid_init()
+    hid_device* hid_open(unsigned short vendor_id, unsigned short product_id,
+                         const wchar_t* serial_number)
+    void hid_close(hid_device* dev)
+    int hid_write(hid_device* dev, const unsigned char* data, size_t length)
+    int hid_read_timeout(hid_device* dev, unsigned char* data, size_t length,
+                         int milliseconds)
+    int hid_send_feature_report(hid_device* dev, const unsigned char* data,
+                                size_t length)
+    int hid_get_manufacturer_string(hid_device* dev, wchar_t* string, size_t maxlen)
+    int hid_get_product_string(hid_device* dev, wchar_t* string, size_t maxlen)
+    int hid_get_serial_number_string(hid_device* dev, wchar_t* string, size_t maxlen)
+
+
+cdef enum:
+    REPORT_LEN = 64
+    STRING_LEN = 256
+
+
+cdef class _HidDev:
+    """
+    Minimal stand-in for hid.device (only what Cp2112I2CBus uses),
+    with the GIL released during USB I/O.
+    """
+
+    cdef hid_device* _h
+
+    def __cinit__(self):
+        self._h = NULL
+
+    def __dealloc__(self):
+        if self._h != NULL:
+            hid_close(self._h)
+            self._h = NULL
+
+    cdef hid_device* _handle(self) except NULL:
+        if self._h == NULL:
+            raise OSError("CP2112 device not open")
+        return self._h
+
+    def open(self, int vendor_id, int product_id, serial=None):
+        cdef wchar_t* wserial = NULL
+        if hid_init() < 0:
+            raise OSError("hid_init failed")
+        if serial is not None:
+            wserial = PyUnicode_AsWideCharString(serial, NULL)
+        try:
+            with nogil:
+                self._h = hid_open(<unsigned short>vendor_id,
+                                   <unsigned short>product_id, wserial)
+        finally:
+            if wserial != NULL:
+                PyMem_Free(wserial)
+        if self._h == NULL:
+            raise OSError("open failed")
+
+    def close(self):
+        if self._h != NULL:
+            hid_close(self._h)
+            self._h = NULL
+
+    def write(self, const unsigned char[::1] buf) -> int:
+        cdef hid_device* h = self._handle()
+        cdef int r
+        with nogil:
+            r = hid_write(h, &buf[0], buf.shape[0])
+        if r < 0:
+            raise OSError("write error")
+        return r
+
+    def read(self, int max_length, int timeout_ms=-1) -> bytes:
+        # timeout_ms=-1 blocks, like hid.device.read() (whose 0 also blocks);
+        # hid_read_timeout(0) would be a non-blocking poll instead.
+        cdef hid_device* h = self._handle()
+        cdef unsigned char resp[REPORT_LEN]
+        cdef int r
+        if max_length > REPORT_LEN:
+            max_length = REPORT_LEN
+        with nogil:
+            r = hid_read_timeout(h, resp, max_length, timeout_ms)
+        if r < 0:
+            raise OSError("read error")
+        return (<char*>resp)[:r]
+
+    def send_feature_report(self, payload) -> int:
+        cdef bytes data = bytes(payload)
+        cdef const unsigned char* p = data
+        cdef size_t size = len(data)
+        cdef hid_device* h = self._handle()
+        cdef int r
+        with nogil:
+            r = hid_send_feature_report(h, p, size)
+        if r < 0:
+            raise OSError("send_feature_report failed")
+        return r
+
+    def get_manufacturer_string(self) -> str:
+        cdef wchar_t buf[STRING_LEN]
+        if hid_get_manufacturer_string(self._handle(), buf, STRING_LEN) < 0:
+            raise OSError("get_manufacturer_string failed")
+        return PyUnicode_FromWideChar(buf, -1)
+
+    def get_product_string(self) -> str:
+        cdef wchar_t buf[STRING_LEN]
+        if hid_get_product_string(self._handle(), buf, STRING_LEN) < 0:
+            raise OSError("get_product_string failed")
+        return PyUnicode_FromWideChar(buf, -1)
+
+    def get_serial_number_string(self) -> str:
+        cdef wchar_t buf[STRING_LEN]
+        if hid_get_serial_number_string(self._handle(), buf, STRING_LEN) < 0:
+            raise OSError("get_serial_number_string failed")
+        return PyUnicode_FromWideChar(buf, -1)
+
+    def write_read_request(self, int i2c_addr, int reg, int n):
+        """0x11: Data Write-Read Request (write_len=1, the register address)."""
+        cdef hid_device* h = self._handle()
+        cdef unsigned char req[6]
+        cdef int r
+        req[0] = 0x11
+        req[1] = (i2c_addr << 1) & 0xFE
+        req[2] = (n >> 8) & 0xFF
+        req[3] = n & 0xFF
+        req[4] = 0x01
+        req[5] = reg & 0xFF
+        with nogil:
+            r = hid_write(h, req, 6)
+        if r <= 0:
+            raise Cp2112Error("CP2112 read: write-read request failed")
+
+    def force_read(self, int n, int timeout_ms) -> bytes:
+        """
+        0x12 Force Read / 0x13 Response loop, entirely without the GIL.
+        Stops early (returns fewer than n bytes) when a response carries
+        no data, so the caller can fall back to the 0x15 status poll.
+        """
+        cdef hid_device* h = self._handle()
+        cdef bytearray out = bytearray(n)
+        cdef unsigned char* p = out
+        cdef unsigned char fr[3]
+        cdef unsigned char resp[REPORT_LEN]
+        cdef int got = 0, remain, length, i, r = 0
+        fr[0] = 0x12
+        with nogil:
+            while got < n:
+                remain = n - got
+                fr[1] = (remain >> 8) & 0xFF
+                fr[2] = remain & 0xFF
+                r = hid_write(h, fr, 3)
+                if r < 0:
+                    break
+                r = hid_read_timeout(h, resp, REPORT_LEN, timeout_ms)
+                # resp[0]=0x13, resp[1]=status, resp[2]=length, resp[3:]=data
+                if r < 3 or resp[0] != 0x13 or resp[2] == 0:
+                    break
+                length = resp[2]
+                if length > remain:
+                    length = remain
+                if length > r - 3:
+                    length = r - 3
+                for i in range(length):
+                    p[got + i] = resp[3 + i]
+                got += length
+        if r < 0:
+            raise OSError("read error")
+        return bytes(out[:got])
+
+
+class FastBus(Cp2112I2CBus):
+    """Cp2112I2CBus backed by _HidDev, with the read path done in C."""
+
+    def _open_device(self, vendor_id, product_id, serial):
+        dev = _HidDev()
+        dev.open(vendor_id, product_id, serial)
+        return dev
+
+    def read_regN(self, i2c_addr: int, reg: int, n: int) -> bytes:
+        if not (1 <= n <= 512):
+            raise ValueError("n must be 1..512")
+
+        dev = self._dev
+        dev.write_read_request(i2c_addr, reg, n)
+        data = dev.force_read(n, 20)
+        if len(data) < n:
+            # recovery: poll status once, then collect the rest
+            self._wait_transfer_complete()
+            data += dev.force_read(n - len(data), 20)
+            if len(data) < n:
+                raise Cp2112Error("CP2112 read: empty response")
+        return data
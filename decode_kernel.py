@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+decode_kernel.py
+
+Batched slot decoder for many 12-bit samples (history / trend graphs).
+The live /api/status path keeps using app.decode(); this module is for
+decoding thousands of stored bits12 samples at once.
+
+Numba is optional: without it the same loop runs as plain Python.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba not installed → plain Python fallback
+    njit = None
+
+# bits12 内での各スロットの下位ビット位置 (S1..S6)
+#   S1..S3: B0..B5 → bit6..11, S4..S6: A0..A5 → bit0..5
+_SLOT_LO_BITS = (6, 8, 10, 0, 2, 4)
+
+
+def _decode_many(bits_arr, out_states):
+    """
+    bits_arr  : uint16[N]    bits12 samples
+    out_states: uint8[N, 6]  (G << 1) | R for each slot
+                             → index into app._PAIR_STATE_LUT
+    """
+    for i in range(bits_arr.shape[0]):
+        b = bits_arr[i]
+        for s in range(6):
+            out_states[i, s] = (b >> _SLOT_LO_BITS[s]) & 3
+    return out_states
+
+
+if njit is not None:
+    # 明示シグネチャで import 時にコンパイル（初回呼び出しの JIT 待ちをなくす）
+    decode_many = njit("uint8[:, :](uint16[:], uint8[:, :])", cache=True)(_decode_many)
+else:
+    decode_many = _decode_many
+
+
+def decode_history(bits_arr: np.ndarray) -> np.ndarray:
+    """bits12 の配列から uint8[N, 6] の状態コード配列を作って返す。"""
+    bits_arr = np.ascontiguousarray(bits_arr, dtype=np.uint16)
+    out = np.empty((bits_arr.shape[0], 6), dtype=np.uint8)
+    return decode_many(bits_arr, out)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+setup_fast.py
+
+Build the optional Cython accelerator (cp2112_fast.pyx) in place:
+    python setup_fast.py build_ext --inplace
+
+hidapi library name / header location differ per platform:
+    Linux  : libhidapi-hidraw, headers in /usr/include/hidapi
+    macOS  : libhidapi (Homebrew), headers in <brew prefix>/include/hidapi
+    Windows: hidapi.lib / hidapi.h from the hidapi release zip
+
+Set HIDAPI_DIR to override the search location. It must contain
+include/ (or include/hidapi/) with hidapi.h, and lib/ (or x64/ / x86/
+as in the Windows release zip) with the library.
+"""
+
+import os
+import sys
+
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+
+
+def _hidapi_paths() -> tuple[list[str], list[str], list[str]]:
+    """(libraries, include_dirs, library_dirs) for the current platform."""
+    root = os.environ.get("HIDAPI_DIR")
+    if sys.platform.startswith("linux"):
+        libraries = ["hidapi-hidraw"]
+        root = root or "/usr"
+    elif sys.platform == "darwin":
+        libraries = ["hidapi"]
+        root = root or "/opt/homebrew"
+    elif sys.platform == "win32":
+        libraries = ["hidapi"]
+        if not root:
+            sys.exit("set HIDAPI_DIR to the extracted hidapi release (include/, lib/)")
+    else:
+        libraries = ["hidapi"]
+        root = root or "/usr/local"
+
+    include_dirs = [
+        os.path.join(root, "include", "hidapi"),
+        os.path.join(root, "include"),
+    ]
+    library_dirs = [os.path.join(root, "lib")]
+    if sys.platform == "win32":
+        arch = "x64" if sys.maxsize > 2**32 else "x86"
+        library_dirs.append(os.path.join(root, arch))
+    return libraries, include_dirs, library_dirs
+
+
+libraries, include_dirs, library_dirs = _hidapi_paths()
+
+setup(
+    name="cp2112_fast",
+    ext_modules=cythonize(
+        [
+            Extension(
+                "cp2112_fast",
+                ["cp2112_fast.pyx"],
+                libraries=libraries,
+                include_dirs=include_dirs,
+                library_dirs=library_dirs,
+            )
+        ],
+        compiler_directives={"language_level": "3"},
+    ),
+)